@@ -0,0 +1,83 @@
+# db.py
+# Schéma SQLite partagé par questionnaire.py et pages/historique.py
+import os
+
+DB_PATH = "evaluation.db"
+TABLE = "reponses"                      # format long : une ligne par (axe, critère)
+TABLE_QUESTIONS = "questions_ouvertes"  # une ligne par participant
+ANCIENNE_TABLE = "evaluations"          # ancien format large (une ligne par axe)
+VERSION_FORMAT_LONG = 1                 # PRAGMA user_version une fois la reprise faite
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id_participant TEXT,
+    date_validation TEXT,
+    axe TEXT,
+    critere TEXT,
+    note INTEGER
+);
+CREATE TABLE IF NOT EXISTS {TABLE_QUESTIONS} (
+    id_participant TEXT,
+    date_validation TEXT,
+    autres_criteres TEXT,
+    commentaires TEXT
+);
+-- Sert le tri par date (historique) et les regroupements par axe
+CREATE INDEX IF NOT EXISTS idx_reponses_date_axe ON {TABLE}(date_validation, axe);
+"""
+
+def mtimes_base(path):
+    # En mode WAL, les écritures ne touchent que le fichier -wal jusqu'au checkpoint
+    wal = path + "-wal"
+    return os.path.getmtime(path), (os.path.getmtime(wal) if os.path.exists(wal) else 0.0)
+
+def initialiser_base(conn):
+    # Tables / index du format long, puis reprise éventuelle de l'ancien format
+    conn.executescript(SCHEMA)
+    migrer_ancienne_table(conn)
+
+def _reprise_necessaire(conn):
+    # Ancienne table présente et table longue encore vide
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (ANCIENNE_TABLE,)
+    ).fetchone():
+        return False
+    return conn.execute(f"SELECT 1 FROM {TABLE} LIMIT 1").fetchone() is None
+
+def migrer_ancienne_table(conn):
+    # Reprise unique des réponses enregistrées au format large dans `evaluations`
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= VERSION_FORMAT_LONG:
+        return
+    if not _reprise_necessaire(conn):
+        conn.execute(f"PRAGMA user_version = {VERSION_FORMAT_LONG}")
+        return
+    # Verrou d'écriture seulement si une reprise reste à faire, puis nouveau test sous verrou
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        if _reprise_necessaire(conn):
+            _copier_ancienne_table(conn)
+        conn.execute(f"PRAGMA user_version = {VERSION_FORMAT_LONG}")
+
+def _copier_ancienne_table(conn):
+    colonnes = [d[0] for d in conn.execute(f"SELECT * FROM {ANCIENNE_TABLE} LIMIT 0").description]
+    meta = {"id_participant", "date_validation", "critere_evaluation",
+            "Autres critères suggérés", "Commentaires / Remarques"}
+    for c in colonnes:
+        if c in meta:
+            continue
+        col = '"' + c.replace('"', '""') + '"'
+        conn.execute(
+            f"INSERT INTO {TABLE} "
+            f"SELECT id_participant, date_validation, critere_evaluation, ?, CAST({col} AS INTEGER) "
+            f"FROM {ANCIENNE_TABLE} "
+            f"WHERE typeof({col}) IN ('integer', 'real') OR CAST({col} AS INTEGER) || '' = {col}",
+            (c,)
+        )
+    if {"Autres critères suggérés", "Commentaires / Remarques"} <= set(colonnes):
+        conn.execute(f"""
+            INSERT INTO {TABLE_QUESTIONS}
+            SELECT id_participant, date_validation, "Autres critères suggérés", "Commentaires / Remarques"
+            FROM {ANCIENNE_TABLE}
+            WHERE COALESCE("Autres critères suggérés", '') <> ''
+               OR COALESCE("Commentaires / Remarques", '') <> ''
+        """)
@@ -3,72 +3,88 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 from pathlib import Path
-import plotly.graph_objects as go
+
+from db import DB_PATH, TABLE, initialiser_base, mtimes_base
 
 st.set_page_config(page_title="Historique des réponses", page_icon="📈", layout="wide")
 
-DB_PATH = "evaluation.db"
-TABLE = "evaluations"
+MAX_RAYONS = 30  # au-delà, le radar par critère regroupe le reste dans « Autres »
 
 # 0) Sécurité: base présente ?
 if not Path(DB_PATH).exists():
     st.error(f"Base introuvable : {DB_PATH}")
     st.stop()
 
-# 1) Lecture DB
-with sqlite3.connect(DB_PATH) as conn:
-    df = pd.read_sql(f"SELECT * FROM {TABLE}", conn)
-
-if df.empty:
+# 1) Agrégats SQL sur la table longue (une ligne par participant × axe × critère)
+GROUP_COLS = {"Critère": "critere", "Axe": "axe"}
+
+def _stats_sql(by):
+    col = GROUP_COLS[by]
+    return f"""
+WITH ranked AS (
+    SELECT {col} AS cle, CAST(note AS REAL) AS note,
+           ROW_NUMBER() OVER (PARTITION BY {col} ORDER BY note) AS rn,
+           COUNT(*) OVER (PARTITION BY {col}) AS n
+    FROM {TABLE}
+    WHERE note IS NOT NULL AND {col} IS NOT NULL
+)
+SELECT cle AS "{by}",
+       COUNT(*) AS N,
+       AVG(note) AS Moyenne,
+       AVG(CASE WHEN rn IN ((n + 1) / 2, (n + 2) / 2) THEN note END) AS Médiane,
+       (SUM(note * note) - SUM(note) * SUM(note) / COUNT(*)) / NULLIF(COUNT(*) - 1, 0) AS Variance,
+       MIN(note) AS Min,
+       MAX(note) AS Max
+FROM ranked
+GROUP BY cle
+"""
+
+# 2) Lecture DB : agrégats uniquement (mis en cache, invalidés quand la base ou son WAL change)
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_stats(path, mtimes):
+    with sqlite3.connect(path) as conn:
+        n_rows = conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+        stats = {}
+        for by in GROUP_COLS:
+            out = pd.read_sql(_stats_sql(by), conn)
+            out["ÉcartType"] = out.pop("Variance").clip(lower=0) ** 0.5
+            stats[by] = (
+                out[[by, "N", "Moyenne", "Médiane", "ÉcartType", "Min", "Max"]]
+                    .sort_values("Moyenne", ascending=False, ignore_index=True)
+            )
+    return n_rows, stats["Critère"], stats["Axe"]
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_tail(path, mtimes, n=5):
+    with sqlite3.connect(path) as conn:
+        return pd.read_sql(
+            f"SELECT * FROM {TABLE} ORDER BY date_validation DESC, rowid DESC LIMIT {int(n)}", conn
+        ).rename(columns={
+            "date_validation": "Date",
+            "axe": "Axe",
+            "critere": "Critère",
+            "note": "Note",
+        })
+
+@st.cache_resource(show_spinner=False)
+def preparer_base(path):
+    # Schéma + reprise de l'ancienne table une fois par processus, hors des lectures en cache,
+    # même si la page principale n'a pas encore été ouverte
+    with sqlite3.connect(path, timeout=30) as conn:
+        initialiser_base(conn)
+
+preparer_base(DB_PATH)
+mtimes = mtimes_base(DB_PATH)
+n_rows, stats_crit, stats_axes = load_stats(DB_PATH, mtimes)
+
+if not n_rows:
     st.info("Aucune donnée pour le moment.")
     st.stop()
 
-# 2) Harmoniser quelques noms
-df = df.rename(columns={
-    "date_validation": "Date",
-    "critere_evaluation": "Axe",
-})
-
-# 3) Colonnes méta exactes d’après ton schéma
-meta_cols = {
-    "id_participant",
-    "Date",
-    "Axe",
-    "Autres critères suggérés",
-    "Commentaires / Remarques",
-}
-
-# 4) Colonnes critères (tout ce qui n’est pas méta)
-critere_cols = [c for c in df.columns if c not in meta_cols]
-
-# 5) Long format → colonnes: Date, Axe, id_participant, Critère, Note
-long = df.melt(
-    id_vars=[c for c in ["Date", "Axe", "id_participant"] if c in df.columns],
-    value_vars=critere_cols,
-    var_name="Critère",
-    value_name="Note",
-)
-
-# 6) Nettoyage / types
-long["Note"] = pd.to_numeric(long["Note"], errors="coerce")
-long = long.dropna(subset=["Note"])
-if "Date" in long.columns:
-    long["Date"] = pd.to_datetime(long["Date"], errors="coerce")
-
-# 7) Stats par Critère et par Axe (avec Médiane)
-stats_crit = (
-    long.groupby("Critère", as_index=False)["Note"]
-        .agg(N="count", Moyenne="mean", Médiane="median", ÉcartType="std", Min="min", Max="max")
-        .sort_values("Moyenne", ascending=False)
-)
-
-stats_axes = (
-    long.groupby("Axe", as_index=False)["Note"]
-        .agg(N="count", Moyenne="mean", Médiane="median", ÉcartType="std", Min="min", Max="max")
-        .sort_values("Moyenne", ascending=False)
-)
+# Import différé : plotly n'est chargé que si la base contient des données
+import plotly.graph_objects as go
 
-# 8) UI
+# 3) UI
 st.title("📈 Historique des réponses")
 col_top1, col_top2 = st.columns(2)
 with col_top1:
@@ -77,11 +93,18 @@ with col_top1:
 with col_top2:
     lock_range = st.checkbox("Fixer l’échelle 1–10", value=True)
 
-# 9) Radar Critères
+# 4) Radar Critères
 st.subheader(f"Radar par **critère** ({metric})")
 if not stats_crit.empty:
     r_vals = stats_crit[metric].tolist()
     theta_vals = stats_crit["Critère"].tolist()
+    if len(theta_vals) > MAX_RAYONS:
+        # Garde les critères les plus dispersés, agrège les autres en un seul rayon
+        keep = stats_crit.nlargest(MAX_RAYONS - 1, "ÉcartType")["Critère"]
+        kept = stats_crit[stats_crit["Critère"].isin(keep)]
+        others = stats_crit[~stats_crit["Critère"].isin(keep)]
+        r_vals = kept[metric].tolist() + [others[metric].mean()]
+        theta_vals = kept["Critère"].tolist() + ["Autres"]
     fig_crit = go.Figure()
     fig_crit.add_trace(go.Scatterpolar(
         r=r_vals, theta=theta_vals,
@@ -97,9 +120,9 @@ if not stats_crit.empty:
 else:
     st.info("Pas de données critère.")
 
-# 10) Radar Axes
+# 5) Radar Axes
 st.subheader(f"Radar par **axe** ({metric})")
-if "Axe" in long.columns and not stats_axes.empty:
+if not stats_axes.empty:
     r_vals = stats_axes[metric].tolist()
     theta_vals = stats_axes["Axe"].tolist()
     fig_axes = go.Figure()
@@ -117,7 +140,7 @@ if "Axe" in long.columns and not stats_axes.empty:
 else:
     st.info("Pas de données axe.")
 
-# 11) Tables détaillées
+# 6) Tables détaillées
 st.subheader("📋 Statistiques détaillées")
 tabs = st.tabs(["Par critère", "Par axe", "Brut (5 dernières lignes)"])
 with tabs[0]:
@@ -125,4 +148,4 @@ with tabs[0]:
 with tabs[1]:
     st.dataframe(stats_axes, use_container_width=True)
 with tabs[2]:
-    st.dataframe(df.tail(5), use_container_width=True)
+    st.dataframe(load_tail(DB_PATH, mtimes), use_container_width=True)
@@ -3,15 +3,16 @@ import pandas as pd
 import sqlite3
 from datetime import datetime
 import os
-import gspread
 #from google.oauth2.service_account import Credentials
 import numpy as np
 import uuid
+import threading
+
+from db import DB_PATH, TABLE, TABLE_QUESTIONS, initialiser_base, mtimes_base
 
 # --- Fonction de sauvegarde Google Sheets ---
 # --- Google Sheets (via Streamlit Secrets) ---
 import json
-from google.oauth2.service_account import Credentials as SACredentials
 
 # (optionnel) ID par défaut si rien n'est défini dans les secrets
 DEFAULT_SHEET_ID = "1HbregwmVT8-adMkFxWGBu_JNSfrmBHM3FJWCR3hI_dI"
@@ -19,7 +20,12 @@ DEFAULT_SHEET_ID = "1HbregwmVT8-adMkFxWGBu_JNSfrmBHM3FJWCR3hI_dI"
 # Lit l'ID depuis les secrets, sinon fallback sur DEFAULT_SHEET_ID
 GOOGLE_SHEET_ID = st.secrets.get("gcp", {}).get("sheet_id", DEFAULT_SHEET_ID)
 
+@st.cache_resource(show_spinner=False)
 def _get_gspread_client():
+    # Imports différés : gspread / google-auth ne sont chargés qu'à la première sauvegarde
+    import gspread
+    from google.oauth2.service_account import Credentials as SACredentials
+
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
@@ -32,6 +38,33 @@ def _get_gspread_client():
     creds = SACredentials.from_service_account_info(info, scopes=scopes)
     return gspread.authorize(creds)
 
+@st.cache_resource(show_spinner=False)
+def _get_sheet(sheet_id: str):
+    return _get_gspread_client().open_by_key(sheet_id).sheet1
+
+SHEETS_EPOCH = pd.Timestamp("1899-12-30")  # jour 0 des dates sérielles Google Sheets
+DATE_TIME_FORMAT = {"numberFormat": {"type": "DATE_TIME", "pattern": "yyyy-mm-dd hh:mm:ss"}}
+
+def _cell(value):
+    # Valeur Python -> CellData de l'API Sheets (cellule vide si "" / None)
+    if value is None or (isinstance(value, str) and not value):
+        return {}
+    if isinstance(value, (datetime, np.datetime64)):
+        # Date sérielle + format date/heure, comme une date saisie en USER_ENTERED
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        serial = (ts - SHEETS_EPOCH) / pd.Timedelta(days=1)
+        return {"userEnteredValue": {"numberValue": serial}, "userEnteredFormat": DATE_TIME_FORMAT}
+    if isinstance(value, (bool, np.bool_)):
+        return {"userEnteredValue": {"boolValue": bool(value)}}
+    if isinstance(value, (int, float, np.number)):
+        return {"userEnteredValue": {"numberValue": float(value)}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+def _row_data(values):
+    return {"values": [_cell(v) for v in values]}
+
 def sauvegarder_reponses_google_sheets(df: pd.DataFrame, sheet_id: str | None = None,
                                        header_mode: str = "insert_if_missing"):
     """
@@ -44,37 +77,61 @@ def sauvegarder_reponses_google_sheets(df: pd.DataFrame, sheet_id: str | None =
         st.error("Aucun 'sheet_id' fourni et aucun 'gcp.sheet_id' dans les secrets.")
         return
 
-    client = _get_gspread_client()
-    sheet = client.open_by_key(sheet_id).sheet1
+    sheet = _get_sheet(sheet_id)
 
-    # Nettoyage valeurs (inf/NaN) et datetimes -> string
-    df = df.copy()
-    for c in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[c]):
-            df[c] = pd.to_datetime(df[c], errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S")
+    # Nettoyage valeurs (inf/NaN) ; les datetimes deviennent des dates sérielles dans _cell
     df = df.replace([np.nan, np.inf, -np.inf], "", regex=False)
 
     headers = [str(c) for c in df.columns.tolist()]
 
-    # Gestion des en-têtes
+    # Toutes les écritures (en-têtes + données) partent dans un seul batchUpdate
+    requests = []
+    header_range = {
+        "sheetId": sheet.id,
+        "startRowIndex": 0, "endRowIndex": 1,
+        "startColumnIndex": 0, "endColumnIndex": len(headers),
+    }
+    write_headers = {
+        "updateCells": {"range": header_range, "rows": [_row_data(headers)], "fields": "userEnteredValue"}
+    }
+
+    # Gestion des en-têtes (première ligne lue une seule fois par session)
+    header_key = None
     if header_mode != "keep":
-        try:
-            first_row = sheet.row_values(1)
-        except Exception:
-            first_row = []
+        header_key = f"sheet_headers_{sheet_id}"
+        first_row = st.session_state.get(header_key)
+        if first_row is None:
+            try:
+                first_row = sheet.row_values(1)
+            except Exception:
+                first_row = []
         if not first_row:
-            sheet.update("A1", [headers])
+            requests.append(write_headers)
         else:
             if first_row != headers:
                 if header_mode == "insert_if_missing":
-                    sheet.insert_row(headers, 1)
+                    requests.append({"insertDimension": {
+                        "range": {"sheetId": sheet.id, "dimension": "ROWS", "startIndex": 0, "endIndex": 1},
+                        "inheritFromBefore": False,
+                    }})
+                    requests.append(write_headers)
                 elif header_mode == "overwrite":
-                    sheet.update("1:1", [headers])
+                    requests.append(write_headers)
 
-    # Ajout des données
-    rows = df.astype(object).values.tolist()
+    # Ajout des données (appendCells : ajout atomique après la dernière ligne remplie)
+    rows = [list(t) for t in df.itertuples(index=False, name=None)]
     if rows:
-        sheet.append_rows(rows, value_input_option="USER_ENTERED")
+        requests.append({"appendCells": {
+            "sheetId": sheet.id,
+            "rows": [_row_data(r) for r in rows],
+            "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+        }})
+
+    if requests:
+        sheet.spreadsheet.batch_update({"requests": requests})
+    # Mémorisé seulement une fois l'écriture réussie (sinon l'en-tête serait sauté au nouvel essai)
+    if header_key is not None:
+        st.session_state[header_key] = headers
 
 
 # --- Config page ---
@@ -110,6 +167,9 @@ axes_definitions = {
     "temporalité/Durabilité": "Stabilité de l'importance du critère dans le temps"
 }
 
+# Libellés markdown des axes, construits une seule fois
+AXIS_LABELS = tuple((axe, f"**{axe.capitalize()}** — *{axes_definitions[axe]}*") for axe in axes)
+
 # --- Init session ---
 if "page" not in st.session_state:
     st.session_state.page = 0
@@ -124,32 +184,70 @@ if "id_participant" not in st.session_state:
 def enregistrer_reponse(notes, critere):
     st.session_state.reponses[critere] = notes
 
-def sauvegarder_reponses_sqlite(df):
-    conn = sqlite3.connect("evaluation.db")
-    df.to_sql("evaluations", conn, if_exists="append", index=False)
-    conn.close()
+def lire_notes(page):
+    # Valeurs des sliders du formulaire, transmises seulement à la soumission
+    return {axe: st.session_state[f"slider-{page}-{axe}"] for axe in axes}
+
+INSERT_REPONSE = f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?)"
+INSERT_QUESTIONS = f"INSERT INTO {TABLE_QUESTIONS} VALUES (?, ?, ?, ?)"
+
+@st.cache_resource(show_spinner=False)
+def _get_sqlite_conn(path: str = DB_PATH):
+    # Connexion partagée entre sessions, PRAGMA et schéma appliqués une seule fois
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    initialiser_base(conn)
+    return conn
+
+@st.cache_resource(show_spinner=False)
+def _get_sqlite_lock():
+    # Sérialise les transactions des différentes sessions sur la connexion partagée
+    return threading.Lock()
+
+def sauvegarder_reponses_sqlite(reponses, autres_criteres, commentaires, id_participant, date_validation,
+                                conn=None):
+    if conn is None:
+        conn = _get_sqlite_conn()
+    # Une ligne par (axe, critère) noté, sans remplissage
+    lignes = [
+        (id_participant, date_validation, axe, critere, reponses[critere][axe])
+        for axe in axes for critere in criteres
+        if axe in reponses.get(critere, {})
+    ]
+    with _get_sqlite_lock():
+        with conn:
+            conn.executemany(INSERT_REPONSE, lignes)
+            conn.execute(INSERT_QUESTIONS, (id_participant, date_validation, autres_criteres, commentaires))
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def exporter_base(mtimes):
+    # Instantané cohérent de la base (WAL compris) pris sur la connexion partagée ;
+    # un seul objet bytes partagé par toutes les sessions, refait quand la base change
+    conn = _get_sqlite_conn()
+    with _get_sqlite_lock():
+        return conn.serialize()
+
+# Schéma et reprise de l'ancien format dès qu'une base existe
+if os.path.exists(DB_PATH):
+    _get_sqlite_conn()
 
 def transformer_reponses(reponses, autres_criteres, commentaires, id_participant, date_validation):
     # Pivotage : une ligne par axe, colonnes = critères + autres champs
-    lignes = []
-    for i, axe in enumerate(axes):
-        ligne = {
-            "id_participant": id_participant,
-            "date_validation": date_validation,
-            "critere_evaluation": axe
-        }
-        for critere in criteres:
-            note = reponses.get(critere, {}).get(axe, "")
-            ligne[critere] = note
-        # Ajouter les champs ouverts seulement sur la première ligne
-        if i == 0:
-            ligne["Autres critères suggérés"] = autres_criteres
-            ligne["Commentaires / Remarques"] = commentaires
-        else:
-            ligne["Autres critères suggérés"] = ""
-            ligne["Commentaires / Remarques"] = ""
-        lignes.append(ligne)
-    return pd.DataFrame(lignes)
+    notes = np.array(
+        [[reponses.get(critere, {}).get(axe, "") for critere in criteres] for axe in axes],
+        dtype=object
+    )
+    df = pd.DataFrame(notes, columns=criteres).infer_objects()
+    df.insert(0, "critere_evaluation", axes)
+    df.insert(0, "date_validation", date_validation)
+    df.insert(0, "id_participant", id_participant)
+    # Ajouter les champs ouverts seulement sur la première ligne
+    df["Autres critères suggérés"] = ""
+    df.loc[0, "Autres critères suggérés"] = autres_criteres
+    df["Commentaires / Remarques"] = ""
+    df.loc[0, "Commentaires / Remarques"] = commentaires
+    return df
 
 # --- Bloc questionnaire / questions ouvertes ---
 if not st.session_state.fin:
@@ -163,31 +261,31 @@ if not st.session_state.fin:
         st.progress(progress)
         st.caption(f"Progression : {st.session_state.page + 1}/{len(criteres)+1} étapes")
 
-        notes = {}
-        for axe in axes:
-            st.markdown(f"**{axe.capitalize()}** — *{axes_definitions[axe]}*")
-            note = st.slider(
-                f"Note pour {axe}", 1, 10, 5,
-                key=f"slider-{st.session_state.page}-{axe}"
-            )
-            notes[axe] = note
+        # Formulaire : déplacer un slider ne relance pas le script, seul un bouton le fait
+        with st.form(f"form_{st.session_state.page}"):
+            for axe, label in AXIS_LABELS:
+                st.markdown(label)
+                st.slider(
+                    f"Note pour {axe}", 1, 10, 5,
+                    key=f"slider-{st.session_state.page}-{axe}"
+                )
 
-        st.markdown("---")
-        col1, col2 = st.columns([1, 1])
-        with col1:
-            if st.session_state.page > 0:
-                st.button("⬅️ Précédent", on_click=lambda: setattr(st.session_state, 'page', st.session_state.page - 1))
-        with col2:
-            if st.session_state.page < len(criteres) - 1:
-                st.button("Suivant ➡️", on_click=lambda: (
-                    enregistrer_reponse(notes, critere),
-                    setattr(st.session_state, 'page', st.session_state.page + 1)
-                ))
-            else:
-                st.button("📄 Questions ouvertes ➡️", on_click=lambda: (
-                    enregistrer_reponse(notes, critere),
-                    setattr(st.session_state, 'page', st.session_state.page + 1)
-                ))
+            st.markdown("---")
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                if st.session_state.page > 0:
+                    st.form_submit_button("⬅️ Précédent", on_click=lambda: setattr(st.session_state, 'page', st.session_state.page - 1))
+            with col2:
+                if st.session_state.page < len(criteres) - 1:
+                    st.form_submit_button("Suivant ➡️", on_click=lambda: (
+                        enregistrer_reponse(lire_notes(st.session_state.page), critere),
+                        setattr(st.session_state, 'page', st.session_state.page + 1)
+                    ))
+                else:
+                    st.form_submit_button("📄 Questions ouvertes ➡️", on_click=lambda: (
+                        enregistrer_reponse(lire_notes(st.session_state.page), critere),
+                        setattr(st.session_state, 'page', st.session_state.page + 1)
+                    ))
 
     else:
         # 🔹 Questions ouvertes
@@ -211,7 +309,7 @@ if not st.session_state.fin:
         def valider_questionnaire():
             date_validation = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             id_participant = st.session_state.id_participant
-            # Transformation au format cible
+            # Transformation au format cible (Google Sheets)
             df_final = transformer_reponses(
                 st.session_state.reponses,
                 autre_critere,
@@ -219,9 +317,17 @@ if not st.session_state.fin:
                 id_participant,
                 date_validation
             )
-            # Sauvegarde SQLite
-            sauvegarder_reponses_sqlite(df_final)
+            # Sauvegarde SQLite (format long)
+            sauvegarder_reponses_sqlite(
+                st.session_state.reponses,
+                autre_critere,
+                commentaires,
+                id_participant,
+                date_validation
+            )
             # Sauvegarde Google Sheets avec en-têtes
+            # Date réelle (et non texte) dans la feuille
+            df_final["date_validation"] = pd.to_datetime(df_final["date_validation"])
             sheet_id = "1HbregwmVT8-adMkFxWGBu_JNSfrmBHM3FJWCR3hI_dI"  # Remplace par l’ID de ta feuille Google Sheets
             sauvegarder_reponses_google_sheets(df_final, sheet_id, header_mode="insert_if_missing")
             # Marquer questionnaire comme terminé
@@ -238,13 +344,12 @@ if st.session_state.fin:
     """)
 
 # --- Bouton d'export de la base SQLite ---
-if os.path.exists("evaluation.db"):
-    with open("evaluation.db", "rb") as f:
-        st.download_button(
-            label="📥 Télécharger la base de données (evaluation.db)",
-            data=f,
-            file_name="evaluation.db",
-            mime="application/octet-stream"
-        )
+if os.path.exists(DB_PATH):
+    st.download_button(
+        label="📥 Télécharger la base de données (evaluation.db)",
+        data=exporter_base(mtimes_base(DB_PATH)),
+        file_name="evaluation.db",
+        mime="application/octet-stream"
+    )
 else:
     st.info("Aucune base de données à télécharger pour le moment.")